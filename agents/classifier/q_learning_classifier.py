@@ -1,5 +1,4 @@
 # simple tabular Q-learning classifier (toy)
-import random
 import pickle
 import numpy as np
 
@@ -9,26 +8,43 @@ class QClassifier:
         self.states = states
         self.actions = actions
         self.Q = np.zeros((states, actions))
+        # greedy action per state, kept in sync with Q by update_state()
+        self.best_a = np.zeros(states, dtype=np.int64)
         self.alpha = alpha
         self.gamma = gamma
         self.eps = eps
+        self.rng = np.random.default_rng()
 
     def discretize(self, feature_vector):
-        # naive hashing to bucket
-        s = int(abs(hash(tuple(np.round(feature_vector,3)))) % self.states)
-        return s
+        # uniform quantization of the normalized [0,1] feature into a bucket
+        x = float(np.ravel(feature_vector)[0])
+        return min(self.states - 1, max(0, int(x * self.states)))
+
+    def discretize_batch(self, features):
+        # same grid as discretize(), for a whole 1-D array of normalized features
+        buckets = (np.asarray(features, dtype=np.float64) * self.states).astype(np.int32)
+        return np.clip(buckets, 0, self.states - 1)
 
     def act(self, feature_vector):
-        s = self.discretize(feature_vector)
-        if random.random() < self.eps:
-            return random.randrange(self.actions)
-        return int(np.argmax(self.Q[s]))
+        return self.act_state(self.discretize(feature_vector))
+
+    def act_state(self, s):
+        if self.rng.random() < self.eps:
+            return int(self.rng.integers(self.actions))
+        return int(self.best_a[s])
 
     def update(self, feature_vector, action, reward, next_vector):
-        s = self.discretize(feature_vector)
-        s2 = self.discretize(next_vector)
+        self.update_state(self.discretize(feature_vector), action, reward,
+                          self.discretize(next_vector))
+
+    def update_state(self, s, action, reward, s2):
         best_next = np.max(self.Q[s2])
         self.Q[s,action] += self.alpha * (reward + self.gamma*best_next - self.Q[s,action])
+        # only cell (s, action) changed, so row s needs a rescan only if it
+        # was the greedy action or now ties/beats it
+        b = self.best_a[s]
+        if action == b or self.Q[s,action] >= self.Q[s,b]:
+            self.best_a[s] = np.argmax(self.Q[s])
 
     def save(self, path):
         with open(path,'wb') as f:
@@ -37,6 +53,7 @@ class QClassifier:
     def load(self, path):
         with open(path,'rb') as f:
             self.Q = pickle.load(f)
+        self.best_a = np.argmax(self.Q, axis=1)
 
 if __name__ == "__main__":
     print("QClassifier toy ready")
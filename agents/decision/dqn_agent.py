@@ -3,15 +3,22 @@
 # Minimal DQN for per-port decisions based on a small state vector.
 
 import math
-import random
-from collections import deque
 from dataclasses import dataclass
+from typing import Optional
 
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
 
+from agents.decision.replay_buffer import ReplayBuffer
+
+# allow TF32 / reduced-precision internal matmuls where the backend supports it
+torch.set_float32_matmul_precision('high')
+
+# act(): recompute the exponential epsilon schedule every N steps
+EPSILON_REFRESH_EVERY = 64
+
 @dataclass
 class DQNConfig:
     state_dim: int = 4          # e.g., [tx_bps_norm, rx_bps_norm, dpid_norm, port_norm]
@@ -25,6 +32,14 @@ class DQNConfig:
     end_epsilon: float = 0.05
     epsilon_decay: int = 20000  # steps
     target_update_every: int = 1000
+    compile: bool = False       # torch.compile the forward passes (slow first call)
+    inference_dtype: str = 'fp32'  # 'fp32' or 'int8' (dynamic quantization) for greedy act
+    trace: bool = False         # TorchScript-trace the fp32 greedy network (cheap, no compiler)
+    device: str = 'auto'        # 'auto' (cuda if available), 'cpu' or 'cuda'
+    amp: bool = False           # bf16 autocast for the online train forward on CUDA (no effect on CPU)
+    cuda_graph: bool = False    # allow capture_train_graph() (CUDA only; capturable Adam)
+    seed: Optional[int] = None  # seeds the agent's numpy Generator (exploration + replay sampling)
+    sample_block: int = 0       # >0: sample replay windows of this many rows (ReplayBuffer.sample_indices)
 
 class MLP(nn.Module):
     def __init__(self, state_dim, hidden, n_actions):
@@ -39,20 +54,80 @@ class MLP(nn.Module):
     def forward(self, x):
         return self.net(x)
 
+def _maybe_compile(module, enabled, mode='reduce-overhead'):
+    """Return a torch.compile'd view of module, or module itself if disabled/unsupported."""
+    if not enabled or not hasattr(torch, 'compile'):
+        return module
+    try:
+        return torch.compile(module, mode=mode, fullgraph=True)
+    except Exception as e:
+        print(f"[DQNAgent] torch.compile unavailable, running eager: {e}")
+        return module
+
 class DQNAgent:
     def __init__(self, cfg: DQNConfig):
         self.cfg = cfg
         self.q = MLP(cfg.state_dim, cfg.hidden, cfg.n_actions)
         self.target = MLP(cfg.state_dim, cfg.hidden, cfg.n_actions)
         self.target.load_state_dict(self.q.state_dict())
-        self.opt = optim.Adam(self.q.parameters(), lr=cfg.lr)
         self.loss_fn = nn.SmoothL1Loss()
-        self.buffer = deque(maxlen=cfg.buffer_size)
+        self.rng = np.random.default_rng(cfg.seed)
+        self.buffer = ReplayBuffer(cfg.buffer_size, cfg.state_dim, rng=self.rng, block=cfg.sample_block)
         self.step_count = 0
         self.epsilon = cfg.start_epsilon
-        self.device = torch.device('cpu')
+        self._eps_refresh_at = 0
+        if cfg.device == 'auto':
+            self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        else:
+            self.device = torch.device(cfg.device)
         self.q.to(self.device)
         self.target.to(self.device)
+        self._amp = cfg.amp and self.device.type == 'cuda' and torch.cuda.is_bf16_supported()
+        self._graph_ok = cfg.cuda_graph and self.device.type == 'cuda'
+        # fused Adam updates all parameters in one kernel; CPU support needs torch >= 2.4
+        try:
+            self.opt = optim.Adam(self.q.parameters(), lr=cfg.lr, capturable=self._graph_ok, fused=True)
+        except RuntimeError:
+            self.opt = optim.Adam(self.q.parameters(), lr=cfg.lr, capturable=self._graph_ok)
+        # forward callables; self.q / self.target stay plain modules so
+        # state_dict() keys and load_state_dict() are unaffected by compilation.
+        # With a captured train graph, compile must not add CUDA graphs of its own.
+        mode = 'default' if self._graph_ok else 'reduce-overhead'
+        self.q_fwd = _maybe_compile(self.q, cfg.compile, mode)
+        self.target_fwd = _maybe_compile(self.target, cfg.compile, mode)
+        # set by capture_train_graph(): graph, its static inputs and its loss output
+        self._graph = None
+        self._graph_in = None
+        self._graph_loss = None
+        # called between backward() and the optimizer step, e.g. to all-reduce gradients
+        self.grad_hook = None
+        self._act_buf = torch.empty(1, cfg.state_dim, dtype=torch.float32, device=self.device)
+        # network used for greedy (explore=False) actions; see prepare_inference()
+        self.q_infer = self.q_fwd
+
+    def prepare_inference(self):
+        """
+        Rebuild self.q_infer from the current weights of self.q.
+        With cfg.inference_dtype == 'int8' the Linear layers are dynamically
+        quantized; call again after the weights change (load/training).
+        Otherwise, with cfg.trace (and no torch.compile), the network is
+        TorchScript-traced.
+        """
+        self.q_infer = self.q_fwd
+        if self.cfg.inference_dtype == 'int8':
+            try:
+                self.q_infer = torch.ao.quantization.quantize_dynamic(
+                    self.q, {nn.Linear}, dtype=torch.qint8)
+            except Exception as e:
+                print(f"[DQNAgent] int8 quantization failed, using fp32: {e}")
+        elif self.cfg.trace and self.q_fwd is self.q:
+            # traced graph shares self.q's parameters, so later
+            # load_state_dict()/optimizer steps are seen without re-tracing
+            try:
+                example = torch.zeros(1, self.cfg.state_dim, device=self.device)
+                self.q_infer = torch.jit.trace(self.q, example)
+            except Exception as e:
+                print(f"[DQNAgent] torch.jit.trace failed, running eager: {e}")
 
     def act(self, state_np, explore=True):
         """
@@ -61,46 +136,163 @@ class DQNAgent:
         """
         self.step_count += 1
         if explore:
-            self.epsilon = self.cfg.end_epsilon + (self.cfg.start_epsilon - self.cfg.end_epsilon) * \
-                           math.exp(-1.0 * self.step_count / self.cfg.epsilon_decay)
-            if random.random() < self.epsilon:
-                return random.randrange(self.cfg.n_actions)
+            # epsilon moves by <0.4% of its range per 64 steps at the default decay,
+            # so refresh the schedule periodically rather than on every call
+            if self.step_count >= self._eps_refresh_at:
+                self.epsilon = self.cfg.end_epsilon + (self.cfg.start_epsilon - self.cfg.end_epsilon) * \
+                               math.exp(-1.0 * self.step_count / self.cfg.epsilon_decay)
+                self._eps_refresh_at = self.step_count + EPSILON_REFRESH_EVERY
+            if self.rng.random() < self.epsilon:
+                return int(self.rng.integers(self.cfg.n_actions))
 
-        with torch.no_grad():
-            s = torch.tensor(state_np, dtype=torch.float32, device=self.device).unsqueeze(0)
-            qv = self.q(s)
+        # reuse one (1, state_dim) input tensor instead of allocating per call
+        self._act_buf[0].copy_(torch.as_tensor(state_np))
+        with torch.inference_mode():
+            qv = (self.q_fwd if explore else self.q_infer)(self._act_buf)
             a = int(torch.argmax(qv, dim=1).item())
             return a
 
+    def act_batch(self, states_np):
+        """
+        states_np: np.array shape (K, state_dim), float32
+        returns: np.array of K greedy int actions (no exploration)
+        """
+        self.step_count += len(states_np)
+        with torch.inference_mode():
+            s = torch.from_numpy(states_np).to(self.device)
+            return self.q_infer(s).argmax(dim=1).cpu().numpy()
+
     def remember(self, s, a, r, s2, done):
-        self.buffer.append((s, a, r, s2, done))
+        self.buffer.push(s, a, r, s2, done)
+
+    def batch_to_device(self, batch):
+        """
+        (s, a, r, s2, d) numpy arrays from ReplayBuffer.sample() -> tensors on
+        self.device, with a/r/d shaped (B, 1). On CUDA the host arrays are
+        pinned first so the copies can run asynchronously.
+        """
+        pin = self.device.type == 'cuda'
+        def to_dev(x):
+            # sampled arrays are fresh and contiguous; from_numpy wraps them without a copy
+            t = torch.from_numpy(x)
+            if pin:
+                t = t.pin_memory()
+            return t.to(self.device, non_blocking=pin)
+        s, a, r, s2, d = batch
+        return (to_dev(s), to_dev(a).unsqueeze(1), to_dev(r).unsqueeze(1),
+                to_dev(s2), to_dev(d).unsqueeze(1))
 
     def train_step(self):
+        """train_on_batch() on a fresh sample; None until the buffer holds a batch."""
         if len(self.buffer) < self.cfg.batch_size:
-            return 0.0
-        batch = random.sample(self.buffer, self.cfg.batch_size)
-        s, a, r, s2, d = zip(*batch)
-        s = torch.tensor(np.stack(s), dtype=torch.float32, device=self.device)
-        a = torch.tensor(a, dtype=torch.int64, device=self.device).unsqueeze(1)
-        r = torch.tensor(r, dtype=torch.float32, device=self.device).unsqueeze(1)
-        s2 = torch.tensor(np.stack(s2), dtype=torch.float32, device=self.device)
-        d = torch.tensor(d, dtype=torch.float32, device=self.device).unsqueeze(1)
-
-        q_sa = self.q(s).gather(1, a)
+            return None
+        return self.train_on_batch(*self.batch_to_device(self.buffer.sample(self.cfg.batch_size)))
+
+    def train_on_batch(self, s, a, r, s2, d):
+        """One gradient step on a batch already on self.device (see batch_to_device)."""
+        loss = self.fit(s, a, self.targets(r, s2, d))
+
+        if self.step_count % self.cfg.target_update_every == 0:
+            self.target.load_state_dict(self.q.state_dict())
+
+        return loss
+
+    def targets(self, r, s2, d):
+        """Bellman targets r + gamma * (1 - d) * max_a' target(s2, a'), as (B, 1) fp32."""
+        # always fp32: offline these are cached for target_update_every steps
+        # (buffer_targets), so bf16 would save nothing and freeze in its rounding
         with torch.no_grad():
-            q_s2_max = self.target(s2).max(1, keepdim=True)[0]
-            y = r + (1.0 - d) * self.cfg.gamma * q_s2_max
+            q_s2_max = self.target_fwd(s2).max(1, keepdim=True)[0]
+        return r + (1.0 - d.float()) * self.cfg.gamma * q_s2_max
+
+    def buffer_targets(self, chunk=65536):
+        """
+        targets() for every transition in the buffer, as a (len(buffer), 1)
+        tensor on self.device. For a buffer that no longer changes they only
+        move when the target network does, so an offline trainer can compute
+        them once per target sync and train with fit() alone.
+        """
+        b, n = self.buffer, len(self.buffer)
+        y = torch.empty(n, 1, device=self.device)
+        for i in range(0, n, chunk):
+            j = min(i + chunk, n)
+            r, s2, d = (torch.as_tensor(x[i:j], device=self.device)
+                        for x in (b.rewards, b.next_states, b.dones))
+            r, d = r.unsqueeze(1), d.unsqueeze(1)
+            y[i:j] = self.targets(r, s2, d)
+        return y
+
+    def fit(self, s, a, y):
+        """
+        One gradient step of Q(s, a) towards the given targets y. Returns the
+        loss as a detached 0-d tensor on self.device, so callers can
+        accumulate it without a host sync per step.
+        """
+        if self._graph is not None:
+            for dst, src in zip(self._graph_in, (s, a, y)):
+                dst.copy_(src, non_blocking=True)
+            self._graph.replay()
+            return self._graph_loss.clone()  # the static output is overwritten by the next replay
+        self.opt.zero_grad(set_to_none=True)
+        return self._train_ops(s, a, y).detach()
+
+    def _train_ops(self, s, a, y):
+        # forward, loss, backward and optimizer step with no host syncs, so
+        # the same code can be recorded by capture_train_graph(); with cfg.amp
+        # the forward runs in bf16 on CUDA, weights, optimizer state and the loss stay fp32
+        # (autocast's weight-cast cache must be off for CUDA graph capture)
+        with torch.autocast(device_type=self.device.type, dtype=torch.bfloat16,
+                            enabled=self._amp, cache_enabled=not self._graph_ok):
+            q_sa = self.q_fwd(s).gather(1, a)
 
-        loss = self.loss_fn(q_sa, y)
-        self.opt.zero_grad()
+        loss = self.loss_fn(q_sa.float(), y)
         loss.backward()
+        if self.grad_hook is not None:
+            self.grad_hook()
         nn.utils.clip_grad_norm_(self.q.parameters(), 5.0)
         self.opt.step()
+        return loss
 
-        if self.step_count % self.cfg.target_update_every == 0:
-            self.target.load_state_dict(self.q.state_dict())
+    def capture_train_graph(self):
+        """
+        Record one fit() step (forward, loss, backward, clipping, Adam step)
+        for cfg.batch_size into a CUDA graph; fit() then copies each batch
+        and its targets into static inputs and replays it. Needs
+        cfg.cuda_graph and a CUDA device. Weights and optimizer state are
+        reset to their pre-capture values.
+        """
+        if not self._graph_ok:
+            print("[DQNAgent] CUDA graph capture needs cfg.cuda_graph on a CUDA device; skipping")
+            return
+        bs, dim, dev = self.cfg.batch_size, self.cfg.state_dim, self.device
+        static = (torch.zeros(bs, dim, device=dev),
+                  torch.zeros(bs, 1, dtype=torch.int64, device=dev),
+                  torch.zeros(bs, 1, device=dev))
+
+        # capture requires a few warm-up iterations on a side stream; they
+        # take real optimizer steps, so snapshot the weights and undo them
+        saved = [p.detach().clone() for p in self.q.parameters()]
+        side = torch.cuda.Stream()
+        side.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(side):
+            for _ in range(3):
+                self.opt.zero_grad(set_to_none=True)
+                self._train_ops(*static)
+        torch.cuda.current_stream().wait_stream(side)
+        with torch.no_grad():
+            for p, v in zip(self.q.parameters(), saved):
+                p.copy_(v)
+            # zeroed moments and step count == a fresh Adam, at the same addresses
+            for state in self.opt.state.values():
+                for v in state.values():
+                    if torch.is_tensor(v):
+                        v.zero_()
 
-        return float(loss.item())
+        graph = torch.cuda.CUDAGraph()
+        self.opt.zero_grad(set_to_none=True)
+        with torch.cuda.graph(graph):
+            loss = self._train_ops(*static)
+        self._graph, self._graph_in, self._graph_loss = graph, static, loss
 
     def save(self, path):
         torch.save({
@@ -116,3 +308,4 @@ class DQNAgent:
         self.target.load_state_dict(self.q.state_dict())
         self.step_count = ckpt.get('step_count', 0)
         self.epsilon = ckpt.get('epsilon', self.cfg.start_epsilon)
+        self._eps_refresh_at = 0
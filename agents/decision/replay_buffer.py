@@ -1,20 +1,99 @@
-# simple replay buffer
-import random
-from collections import deque
+# simple replay buffer: preallocated numpy ring buffers, one array per field
 import numpy as np
+import torch
 
 class ReplayBuffer:
-    def __init__(self, capacity=100000):
-        self.buffer = deque(maxlen=capacity)
+    def __init__(self, capacity=100000, state_dim=4, rng=None, block=0):
+        self.capacity = capacity
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.block = block  # see sample_indices()
+        self.states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.uint8)  # 0/1; cast to float in the target
+        self.pos = 0
+        self.size = 0
+        self.device = None  # set by to_device()
+
+    @classmethod
+    def from_arrays(cls, states, actions, rewards, next_states, dones, rng=None, block=0):
+        # a full buffer over existing arrays, without copying them (e.g. shared-memory views)
+        buf = cls.__new__(cls)
+        buf.capacity = len(states)
+        buf.rng = rng if rng is not None else np.random.default_rng()
+        buf.block = block
+        buf.states, buf.actions, buf.rewards = states, actions, rewards
+        buf.next_states, buf.dones = next_states, dones
+        buf.pos = 0
+        buf.size = len(states)
+        buf.device = None
+        return buf
+
+    def to_device(self, device):
+        # for a buffer that is no longer written to (offline training): turn
+        # every field into a tensor on `device` (a view, not a copy, on CPU);
+        # sampling then draws and gathers there with torch, no host traffic.
+        # push()/add_batch() are numpy-only and unusable after this, and
+        # sample() then returns tensors on `device`
+        self.device = torch.device(device)
+        for name in ('states', 'actions', 'rewards', 'next_states', 'dones'):
+            setattr(self, name, torch.from_numpy(getattr(self, name)[:self.size]).to(self.device))
+        self._gen = torch.Generator(device=self.device)
+        self._gen.manual_seed(int(self.rng.integers(2 ** 63)))
+        return self
 
     def push(self, state, action, reward, next_state, done):
-        self.buffer.append((state, action, reward, next_state, done))
+        i = self.pos
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        self.pos = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def fields(self):
+        # the per-field storage arrays, in (s, a, r, s2, d) order
+        return (self.states, self.actions, self.rewards, self.next_states, self.dones)
+
+    def add_batch(self, states, actions, rewards, next_states, dones):
+        # same as push() for every row, written as at most two slice copies per field
+        batch = (states, actions, rewards, next_states, dones)
+        n = len(states)
+        if n >= self.capacity:  # only the newest `capacity` rows would survive
+            batch = tuple(x[n - self.capacity:] for x in batch)
+            self.pos = (self.pos + n - self.capacity) % self.capacity
+            n = self.capacity
+        first = min(n, self.capacity - self.pos)
+        for buf, x in zip(self.fields(), batch):
+            buf[self.pos:self.pos + first] = x[:first]
+            buf[:n - first] = x[first:]
+        self.pos = (self.pos + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def sample_indices(self, batch_size):
+        # O(1) per index (with replacement), unlike random.sample over a deque.
+        # With block > 0: whole windows of `block` consecutive rows instead,
+        # far fewer cache misses on big buffers; only unbiased if rows were
+        # stored in random order
+        if self.block <= 0 or self.size < self.block:
+            return self._randint(self.size, batch_size)
+        starts = self._randint(self.size - self.block + 1, -(-batch_size // self.block))
+        if self.device is None:
+            window = np.arange(self.block)
+        else:
+            window = torch.arange(self.block, device=self.device)
+        return (starts[:, None] + window).reshape(-1)[:batch_size]
+
+    def _randint(self, high, n):
+        if self.device is None:
+            return self.rng.integers(0, high, n)
+        return torch.randint(high, (n,), device=self.device, generator=self._gen)
 
     def sample(self, batch_size):
-        batch = random.sample(self.buffer, batch_size)
-        states, actions, rewards, next_states, dones = zip(*batch)
-        return (np.stack(states), np.array(actions), np.array(rewards), np.stack(next_states), np.array(dones))
+        idx = self.sample_indices(batch_size)
+        return tuple(buf[idx] for buf in self.fields())
 
     def __len__(self):
-        return len(self.buffer)
-# placeholder: paste full code here
+        return self.size
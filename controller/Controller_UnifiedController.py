@@ -40,6 +40,7 @@ from agents.multi.agent_manager import AgentManager  # now resolvable
 LOG_DIR = os.path.join(PROJECT_ROOT, 'logs')
 LOG_PATH = os.path.join(LOG_DIR, 'stats_log.csv')
 POLL_INTERVAL = 1.0  # seconds
+LOG_BUFFER_BYTES = 1 << 16  # write buffer for stats_log.csv
 
 # --- action ids ---
 ACT_NOOP    = 0
@@ -61,20 +62,34 @@ class UnifiedController(app_manager.RyuApp):
         self.datapaths = {}            # dpid -> datapath
         self.last_stats = {}           # (dpid,port) -> last sample
         self.meter_installed = set()   # {(dpid, meter_id)}
+        self.last_action = {}          # (dpid,port) -> (action_id, time enforced)
+        self.match_cache = {}          # (dpid,port) -> OFPMatch(in_port=port)
         self.monitor_thread = hub.spawn(self._monitor)
 
         # agent
         self.agent_manager = AgentManager()
         self.agent_manager.load_models()
 
-        # ensure logs csv exists
+        # stats log: one long-lived buffered handle, written by a logger thread
         os.makedirs(LOG_DIR, exist_ok=True)
-        if not os.path.exists(LOG_PATH):
-            with open(LOG_PATH, 'w', newline='') as f:
-                w = csv.writer(f)
-                w.writerow(['timestamp', 'dpid', 'port_no',
-                            'rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets',
-                            'duration_sec'])
+        self._log_fh = open(LOG_PATH, 'a', newline='', buffering=LOG_BUFFER_BYTES)
+        self._csv = csv.writer(self._log_fh)
+        if self._log_fh.tell() == 0:
+            self._csv.writerow(['timestamp', 'dpid', 'port_no',
+                                'rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets',
+                                'duration_sec'])
+        self._log_q = hub.Queue()
+        self.log_thread = hub.spawn(self._drain_log)
+
+    def close(self):
+        super(UnifiedController, self).close()
+        hub.kill(self.log_thread)
+        # write out whatever the logger thread had not reached yet
+        try:
+            while not self._log_q.empty():
+                self._csv.writerows(self._log_q.get_nowait())
+        finally:
+            self._log_fh.close()
 
     # ------------------------------
     # Switch connect / table-miss
@@ -103,6 +118,9 @@ class UnifiedController(app_manager.RyuApp):
             self.datapaths[dp.id] = dp
         elif ev.state == DEAD_DISPATCHER:
             self.datapaths.pop(dp.id, None)
+            # switch may come back without our flows; allow re-enforcement
+            for key in [k for k in self.last_action if k[0] == dp.id]:
+                del self.last_action[key]
 
     # ------------------------------
     # Learning switch
@@ -169,6 +187,8 @@ class UnifiedController(app_manager.RyuApp):
         parser = dp.ofproto_parser
 
         rows = []
+        # ports with a valid rate sample this tick; decided in one batch below
+        act_ports, act_tx, act_rx = [], [], []
         for stat in ev.msg.body:
             port_no = stat.port_no
             key = (dpid, port_no)
@@ -193,42 +213,70 @@ class UnifiedController(app_manager.RyuApp):
                 dt = max(1e-9, now - prev['timestamp'])
                 d_tx = cur['tx_bytes'] - prev['tx_bytes']
                 d_rx = cur['rx_bytes'] - prev['rx_bytes']
-                if d_tx >= 0 and d_rx >= 0:
-                    tx_bps = (d_tx * 8.0) / dt
-                    rx_bps = (d_rx * 8.0) / dt
-
-                    action = self.agent_manager.act(dpid, port_no, tx_bps, rx_bps, explore=False)
-                    self.logger.info("Agent action dpid=%s port=%s tx=%.2fbps rx=%.2fbps -> %s",
-                                     dpid, port_no, tx_bps, rx_bps, action)
-                    try:
-                        self._enforce_action(dp, port_no, action)
-                    except Exception as e:
-                        self.logger.error("Enforce error dpid=%s port=%s: %s", dpid, port_no, e)
+                if d_tx == 0 and d_rx == 0:
+                    pass  # idle port: nothing to decide this tick
+                elif d_tx >= 0 and d_rx >= 0:
+                    act_ports.append(port_no)
+                    act_tx.append((d_tx * 8.0) / dt)
+                    act_rx.append((d_rx * 8.0) / dt)
 
             self.last_stats[key] = cur
 
-        # append raw stats
-        try:
-            with open(LOG_PATH, 'a', newline='') as f:
-                w = csv.writer(f)
-                w.writerows(rows)
-        except Exception as e:
-            self.logger.error("Failed to write stats: %s", e)
+        actions = self.agent_manager.act_batch([dpid] * len(act_ports), act_ports, act_tx, act_rx)
+        for port_no, tx_bps, rx_bps, action in zip(act_ports, act_tx, act_rx, actions):
+            action = int(action)
+            self.logger.info("Agent action dpid=%s port=%s tx=%.2fbps rx=%.2fbps -> %s",
+                             dpid, port_no, tx_bps, rx_bps, action)
+            try:
+                self._enforce_action(dp, port_no, action)
+            except Exception as e:
+                self.logger.error("Enforce error dpid=%s port=%s: %s", dpid, port_no, e)
+
+        # append raw stats (written by _drain_log)
+        self._log_q.put(rows)
+
+    def _drain_log(self):
+        while True:
+            rows = self._log_q.get()
+            try:
+                self._csv.writerows(rows)
+                # flush once the backlog is drained rather than per reply
+                if self._log_q.empty():
+                    self._log_fh.flush()
+            except Exception as e:
+                self.logger.error("Failed to write stats: %s", e)
 
     # ------------------------------
     # Enforcement helpers
     # ------------------------------
+    def _in_port_match(self, dp, in_port):
+        key = (dp.id, in_port)
+        match = self.match_cache.get(key)
+        if match is None:
+            match = dp.ofproto_parser.OFPMatch(in_port=in_port)
+            self.match_cache[key] = match
+        return match
+
     def _enforce_action(self, dp, in_port, action_id):
         ofp = dp.ofproto
         parser = dp.ofproto_parser
 
+        # same action still enforced and its rule is well within the idle
+        # timeout: skip re-sending an identical FlowMod
+        key = (dp.id, in_port)
+        now = time.time()
+        last = self.last_action.get(key)
+        if last is not None and last[0] == action_id and now - last[1] < DEFAULT_IDLE_TO / 2:
+            return
+
         if action_id == 0:  # NOOP
+            self.last_action[key] = (action_id, now)
             return
 
         elif action_id == 1:  # METER
             meter_id = 1000 + int(in_port)
             self._ensure_meter(dp, meter_id, rate_kbps=DEFAULT_LIMIT_KBPS)
-            match = parser.OFPMatch(in_port=in_port)
+            match = self._in_port_match(dp, in_port)
             inst = [
                 parser.OFPInstructionMeter(meter_id),
                 parser.OFPInstructionActions(
@@ -244,7 +292,7 @@ class UnifiedController(app_manager.RyuApp):
                              dp.id, in_port, meter_id, DEFAULT_LIMIT_KBPS)
 
         elif action_id == 2:  # DROP
-            match = parser.OFPMatch(in_port=in_port)
+            match = self._in_port_match(dp, in_port)
             inst = []  # drop
             mod = parser.OFPFlowMod(datapath=dp, priority=400,
                                     match=match, instructions=inst,
@@ -254,7 +302,7 @@ class UnifiedController(app_manager.RyuApp):
                                 dp.id, in_port, DEFAULT_IDLE_TO)
 
         elif action_id == 3:  # REROUTE (stub)
-            match = parser.OFPMatch(in_port=in_port)
+            match = self._in_port_match(dp, in_port)
             inst = [
                 parser.OFPInstructionActions(
                     ofp.OFPIT_APPLY_ACTIONS,
@@ -267,6 +315,8 @@ class UnifiedController(app_manager.RyuApp):
             dp.send_msg(mod)
             self.logger.info("REROUTE stub on dpid=%s in_port=%s (FLOOD)", dp.id, in_port)
 
+        self.last_action[key] = (action_id, now)
+
     def _ensure_meter(self, dp, meter_id, rate_kbps):
         """Create a drop-band meter if not already installed."""
         key = (dp.id, meter_id)
@@ -4,12 +4,18 @@
 # Robust parser for logs/stats_log.csv -> data/features.csv
 # - Handles 8-column Ryu port stats (timestamp, dpid, port_no, rx_bytes, tx_bytes, rx_packets, tx_packets, duration_sec)
 # - Skips malformed rows
-# - Computes per-interval deltas/rates per (dpid,port_no)
+# - Uses pandas when available, otherwise a bytes-level parser into a NumPy record array
+# - Computes per-interval deltas/rates per (dpid,port_no) with one sort + vectorized diffs
 # - Outputs: timestamp, dpid, port_no, tx_bps, rx_bps, tx_pps, rx_pps
 
 import os
-import csv
-from collections import defaultdict
+
+import numpy as np
+
+try:
+    import pandas as pd
+except ImportError:  # fall back to a plain bytes/NumPy parser
+    pd = None
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))
 LOG_PATH = os.path.join(PROJECT_ROOT, 'logs', 'stats_log.csv')
@@ -21,117 +27,179 @@ REQUIRED_NUMERIC = [
     # duration_sec is optional
 ]
 
-def read_stats(path):
-    rows = []
+# target dtype per column; port_no must be 64-bit (OFPP_LOCAL = 4294967294)
+STATS_DTYPES = {
+    'timestamp': np.float64,
+    'dpid': np.int64,
+    'port_no': np.int64,
+    'rx_bytes': np.int64,
+    'tx_bytes': np.int64,
+    'rx_packets': np.int64,
+    'tx_packets': np.int64,
+    'duration_sec': np.int64,
+}
+
+# rows per read_csv chunk
+CHUNK_ROWS = 1_000_000
+
+FEATURE_COLUMNS = ['timestamp', 'dpid', 'port_no', 'tx_bps', 'rx_bps', 'tx_pps', 'rx_pps']
+FEATURE_DTYPES = [np.float64, np.int64, np.int64, np.float64, np.float64, np.float64, np.float64]
+
+def _table(columns):
+    # column name -> array, as a DataFrame or (without pandas) a record array
+    if pd is not None:
+        return pd.DataFrame(columns)
+    return np.rec.fromarrays(list(columns.values()), names=list(columns))
+
+def _empty_stats():
+    return _table({c: np.zeros(0, dtype=t) for c, t in STATS_DTYPES.items()})
+
+def _check_header(headers):
+    # quick sanity
+    missing = [h for h in REQUIRED_NUMERIC if h not in headers]
+    if missing:
+        print(f"[!] CSV missing expected columns: {missing}")
+        print(f"    Found columns: {headers}")
+        # continue anyway; we'll try to parse what we can
+
+def read_stats(path, chunksize=CHUNK_ROWS):
     if not os.path.exists(path):
         print(f"[!] Log file not found: {path}")
-        return rows
-
-    with open(path, 'r', newline='') as f:
-        # Use DictReader to be resilient to column order
-        r = csv.DictReader(f)
-        if r.fieldnames is None:
-            print("[!] CSV appears empty or missing header.")
-            return rows
-
-        # normalize headers (strip spaces)
-        headers = [h.strip() for h in r.fieldnames]
-        # quick sanity
-        missing = [h for h in REQUIRED_NUMERIC if h not in headers]
-        if missing:
-            print(f"[!] CSV missing expected columns: {missing}")
-            print(f"    Found columns: {headers}")
-            # continue anyway; we'll try to parse what we can
-
-        for i, row in enumerate(r, start=2):  # start=2 (line after header)
-            try:
-                rec = {
-                    'timestamp': float(row.get('timestamp', '').strip() or 0.0),
-                    'dpid': int(row.get('dpid', '').strip() or 0),
-                    'port_no': int(row.get('port_no', '').strip() or -1),
-                    'rx_bytes': int(row.get('rx_bytes', '').strip() or 0),
-                    'tx_bytes': int(row.get('tx_bytes', '').strip() or 0),
-                    'rx_packets': int(row.get('rx_packets', '').strip() or 0),
-                    'tx_packets': int(row.get('tx_packets', '').strip() or 0),
-                    'duration_sec': int((row.get('duration_sec') or '0').strip() or 0),
-                }
-                # basic sanity
-                if rec['port_no'] < 0 or rec['timestamp'] <= 0:
-                    continue
-                rows.append(rec)
-            except Exception as e:
-                # Skip malformed lines silently but informative
-                # print(f"[skip line {i}] {e}")
-                continue
-    return rows
-
-def compute_features(rows):
-    # Group by (dpid, port_no) and sort by time
-    groups = defaultdict(list)
-    for r in rows:
-        groups[(r['dpid'], r['port_no'])].append(r)
-
-    feats = []
-    for key, grp in groups.items():
-        grp.sort(key=lambda x: x['timestamp'])
-        prev = None
-        for cur in grp:
-            if prev is None:
-                prev = cur
-                continue
-            dt = cur['timestamp'] - prev['timestamp']
-            if dt <= 0:
-                prev = cur
-                continue
-
-            d_tx_bytes = cur['tx_bytes'] - prev['tx_bytes']
-            d_rx_bytes = cur['rx_bytes'] - prev['rx_bytes']
-            d_tx_pkts  = cur['tx_packets'] - prev['tx_packets']
-            d_rx_pkts  = cur['rx_packets'] - prev['rx_packets']
-
-            # guard against counter resets/wraps
-            if d_tx_bytes < 0 or d_rx_bytes < 0 or d_tx_pkts < 0 or d_rx_pkts < 0:
-                prev = cur
-                continue
-
-            tx_bps = (d_tx_bytes * 8.0) / dt
-            rx_bps = (d_rx_bytes * 8.0) / dt
-            tx_pps = d_tx_pkts / dt
-            rx_pps = d_rx_pkts / dt
-
-            feats.append({
-                'timestamp': cur['timestamp'],
-                'dpid': cur['dpid'],
-                'port_no': cur['port_no'],
-                'tx_bps': tx_bps,
-                'rx_bps': rx_bps,
-                'tx_pps': tx_pps,
-                'rx_pps': rx_pps
-            })
-            prev = cur
-
-    feats.sort(key=lambda x: (x['timestamp'], x['dpid'], x['port_no']))
-    return feats
+        return _empty_stats()
+    if pd is None:
+        return _read_stats_raw(path)
+
+    try:
+        header = pd.read_csv(path, nrows=0).columns
+    except pd.errors.EmptyDataError:
+        print("[!] CSV appears empty or missing header.")
+        return _empty_stats()
+
+    # normalize headers (strip spaces)
+    _check_header([h.strip() for h in header])
+
+    # usecols also tolerates rows carrying more fields than the header;
+    # chunked reads bound the memory held by the parser's intermediates
+    usecols = [h for h in header if h.strip() in STATS_DTYPES]
+    reader = pd.read_csv(path, usecols=usecols, engine='c', float_precision='round_trip',
+                         on_bad_lines='skip', chunksize=chunksize)
+    df = pd.concat([_clean_stats(chunk) for chunk in reader], ignore_index=True)
+    return df
+
+def _clean_stats(df):
+    df.columns = [c.strip() for c in df.columns]
+
+    # optional column: a blank (or missing trailing) cell reads as 0
+    if 'duration_sec' in df.columns:
+        df['duration_sec'] = df['duration_sec'].fillna(0)
+
+    # clean columns already parse as int64/float64 in the C reader; a column
+    # only falls back to strings when a cell is malformed, and that cell then
+    # becomes NaN here and the row is dropped
+    for col in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = df.dropna()
+    for col, dtype in STATS_DTYPES.items():
+        if col in df.columns:
+            df[col] = df[col].astype(dtype)
+        else:
+            df[col] = dtype(0)
+
+    # basic sanity
+    df = df[(df['port_no'] >= 0) & (df['timestamp'] > 0)]
+    return df[list(STATS_DTYPES)]
+
+def _read_stats_raw(path):
+    # pandas-free path: one read, bytes.split per line, tuples straight
+    # into a typed record array (no per-row dicts)
+    with open(path, 'rb') as f:
+        lines = f.read().split(b'\n')
+    headers = [h.strip().decode() for h in lines[0].split(b',')]
+    if headers == ['']:
+        print("[!] CSV appears empty or missing header.")
+        return _empty_stats()
+    _check_header(headers)
+
+    # (field index or None, converter) per output column; absent columns read as 0,
+    # and so does a blank or missing duration_sec (it is optional)
+    def opt_int(b):
+        return int(b.strip() or 0)
+    convs = {'timestamp': float, 'duration_sec': opt_int}
+    fields = [(headers.index(c) if c in headers else None, convs.get(c, int))
+              for c in STATS_DTYPES]
+    width = len(headers)
+    rows = []
+    append = rows.append
+    for ln in lines[1:]:
+        p = ln.split(b',')
+        if len(p) < width:
+            p += [b''] * (width - len(p))
+        try:
+            append(tuple(conv(p[i]) if i is not None else 0 for i, conv in fields))
+        except (ValueError, IndexError):
+            continue  # malformed or blank line
+
+    arr = np.array(rows, dtype=list(STATS_DTYPES.items())).view(np.recarray)
+    # basic sanity
+    return arr[(arr['port_no'] >= 0) & (arr['timestamp'] > 0)]
+
+def compute_features(df):
+    # Works on a DataFrame or a record array: everything below is column arrays.
+    # One stable sort by (dpid, port_no, timestamp) makes each port a
+    # contiguous run, so deltas are plain row-to-row differences that are
+    # valid wherever the key does not change
+    cols = {c: np.asarray(df[c]) for c in ('timestamp', 'dpid', 'port_no',
+                                           'tx_bytes', 'rx_bytes', 'tx_packets', 'rx_packets')}
+    order = np.lexsort((cols['timestamp'], cols['port_no'], cols['dpid']))
+    cols = {c: a[order] for c, a in cols.items()}
+
+    def delta(col):
+        a = cols[col]
+        return a[1:] - a[:-1]
+
+    dpid = cols['dpid']
+    port = cols['port_no']
+    same_port = (dpid[1:] == dpid[:-1]) & (port[1:] == port[:-1])
+
+    dt = delta('timestamp')
+    d_tx_bytes = delta('tx_bytes')
+    d_rx_bytes = delta('rx_bytes')
+    d_tx_pkts  = delta('tx_packets')
+    d_rx_pkts  = delta('rx_packets')
+
+    # also guard against clock skew and counter resets/wraps
+    ok = same_port & (dt > 0) & (d_tx_bytes >= 0) & (d_rx_bytes >= 0) & (d_tx_pkts >= 0) & (d_rx_pkts >= 0)
+    dt = dt[ok]
+
+    feats = {
+        'timestamp': cols['timestamp'][1:][ok],
+        'dpid': dpid[1:][ok],
+        'port_no': port[1:][ok],
+        'tx_bps': d_tx_bytes[ok] * 8.0 / dt,
+        'rx_bps': d_rx_bytes[ok] * 8.0 / dt,
+        'tx_pps': d_tx_pkts[ok] / dt,
+        'rx_pps': d_rx_pkts[ok] / dt,
+    }
+    order = np.lexsort((feats['port_no'], feats['dpid'], feats['timestamp']))
+    return _table({c: feats[c][order].astype(t, copy=False)
+                   for c, t in zip(FEATURE_COLUMNS, FEATURE_DTYPES)})
 
 def write_features(path, feats):
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, 'w', newline='') as f:
-        w = csv.writer(f)
-        w.writerow(['timestamp','dpid','port_no','tx_bps','rx_bps','tx_pps','rx_pps'])
-        for r in feats:
-            w.writerow([
-                f"{r['timestamp']:.6f}", r['dpid'], r['port_no'],
-                f"{r['tx_bps']:.6f}", f"{r['rx_bps']:.6f}",
-                f"{r['tx_pps']:.6f}", f"{r['rx_pps']:.6f}"
-            ])
+    if pd is not None:
+        feats.to_csv(path, columns=FEATURE_COLUMNS, index=False, float_format='%.6f')
+        return
+    fmt = ['%d' if t is np.int64 else '%.6f' for t in FEATURE_DTYPES]
+    np.savetxt(path, feats, fmt=fmt, delimiter=',', header=','.join(FEATURE_COLUMNS), comments='')
 
 def main():
     rows = read_stats(LOG_PATH)
-    if not rows:
+    if len(rows) == 0:
         print(f"[!] No usable rows in {LOG_PATH}")
         return
     feats = compute_features(rows)
-    if not feats:
+    if len(feats) == 0:
         print("[!] No feature rows produced (need >=2 samples per port).")
         return
     write_features(OUT_PATH, feats)
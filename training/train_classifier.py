@@ -5,9 +5,35 @@ import pandas as pd
 from agents.classifier.q_learning_classifier import QClassifier
 import os
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; train_q then runs as plain Python
+    def njit(*args, **kwargs):
+        return lambda f: f
+
 DATA_CSV = os.path.join(os.getcwd(), 'data', 'features.csv')
 MODEL_OUT = os.path.join(os.getcwd(), 'agents', 'classifier', 'q_classifier.pkl')
 
+@njit(cache=True)
+def train_q(Q, best_a, buckets, fnorm, alpha, gamma, eps, eps_flips, rand_actions):
+    # tabular Q-learning over pre-quantized buckets; updates Q and the
+    # per-state greedy action cache best_a in place. eps_flips/rand_actions
+    # hold one pre-drawn coin flip / random action per (epoch, sample).
+    for ep in range(eps_flips.shape[0]):
+        for i in range(len(buckets)-1):
+            s = buckets[i]
+            s2 = buckets[i+1]
+            if eps_flips[ep, i] < eps:
+                action = rand_actions[ep, i]
+            else:
+                action = best_a[s]
+            # toy reward: if throughput high and action==0 (noop) -> +1, else small penalty
+            reward = 1.0 if (fnorm[i] > 0.7 and action==0) else -0.01
+            Q[s, action] += alpha * (reward + gamma*np.max(Q[s2]) - Q[s, action])
+            b = best_a[s]
+            if action == b or Q[s, action] >= Q[s, b]:
+                best_a[s] = np.argmax(Q[s])
+
 def main():
     df = pd.read_csv(DATA_CSV)
     # build feature vectors (simple): throughput per row
@@ -15,15 +41,14 @@ def main():
     # normalize
     fnorm = (features - features.min()) / (features.max() - features.min() + 1e-6)
     clf = QClassifier(states=200, actions=4)
+    # quantize every sample once up front instead of per step
+    buckets = clf.discretize_batch(fnorm)
+    # exploration randomness for all 5 epochs, drawn in two vectorized calls
+    rng = np.random.default_rng(0)
+    eps_flips = rng.random((5, len(fnorm)))
+    rand_actions = rng.integers(0, clf.actions, (5, len(fnorm)))
     # synthetic training loop: treat high throughput = efficient -> reward mapping
-    for ep in range(5):
-        for i in range(len(fnorm)-1):
-            s = np.array([fnorm[i]])
-            s2 = np.array([fnorm[i+1]])
-            action = clf.act(s)
-            # toy reward: if throughput high and action==0 (noop) -> +1, else small penalty
-            reward = 1.0 if (fnorm[i] > 0.7 and action==0) else -0.01
-            clf.update(s, action, reward, s2)
+    train_q(clf.Q, clf.best_a, buckets, fnorm, clf.alpha, clf.gamma, clf.eps, eps_flips, rand_actions)
     clf.save(MODEL_OUT)
     print("Saved classifier to", MODEL_OUT)
 
@@ -3,7 +3,8 @@
 training/train_dqn.py
 
 Offline DQN trainer for the port-level agent.
-Reads data/features.csv and learns a simple policy:
+Reads data/features.csv (converted once to data/features.npy, which
+later runs memory-map) and learns a simple policy:
 - state = [tx_bps_norm, rx_bps_norm, dpid_norm, port_norm]
 - reward = - rx_bps_norm (penalize high ingress load)
   with an extra penalty when rx_bps_norm > 0.8 (congestion)
@@ -13,14 +14,24 @@ Outputs: agents/models/dqn_port.pt which the controller auto-loads.
 
 import os
 import sys
-import csv
 import math
 import time
-import random
-from collections import defaultdict
+import socket
 
 import numpy as np
 import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+try:
+    import pandas as pd
+except ImportError:  # features.csv is then read with np.genfromtxt
+    pd = None
+
+try:
+    from numba import njit, prange, types
+except ImportError:  # numba is optional; build_states() then uses the NumPy expressions
+    njit = None
 
 # ----- resolve project root -----
 PROJECT_ROOT = os.path.dirname(os.path.dirname(__file__))  # ~/Documents/project1
@@ -28,93 +39,162 @@ if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
 from agents.decision.dqn_agent import DQNAgent, DQNConfig
+from agents.decision.replay_buffer import ReplayBuffer
 
 FEATURES_CSV = os.path.join(PROJECT_ROOT, "data", "features.csv")
+# features.csv converted once by prepare_dataset(); later runs memory-map it
+FEATURES_NPY = os.path.join(PROJECT_ROOT, "data", "features.npy")
 MODEL_DIR    = os.path.join(PROJECT_ROOT, "agents", "models")
 MODEL_PATH   = os.path.join(MODEL_DIR, "dqn_port.pt")
 
 # Assume 100 Mbps normalization (adjust if you like)
 BPS_SCALE = 100e6
 
+# learner processes for train_offline; >1 shares the buffer and averages gradients
+NUM_WORKERS = 1
+
+# opt-in GPU fast paths for the offline learner (no effect on CPU): torch.compile
+# the forward passes, replay each train step as one captured CUDA graph, and
+# run the online forward under bf16 autocast.
+# Off until checked against eager losses for the same seed on a GPU.
+COMPILE_ON_CUDA = False
+CUDA_GRAPH = False
+AMP_ON_CUDA = False
+
+# train_offline draws this many batches' indices per sampling call
+MACRO_BATCH_STEPS = 1000
+
+# columns the trainer uses and their dtypes; port_no needs 64 bits (OFPP_LOCAL)
+FEATURE_DTYPES = {
+    "timestamp": np.float64,
+    "dpid": np.int64,
+    "port_no": np.int64,
+    "tx_bps": np.float64,
+    "rx_bps": np.float64,
+}
+FEATURE_DTYPE = np.dtype(list(FEATURE_DTYPES.items()))
+
 def load_features(path):
     """
     Expect header: timestamp, dpid, port_no, tx_bps, rx_bps, tx_pps, rx_pps
-    Returns list of dict rows with floats/ints as appropriate.
+    Returns a FEATURE_DTYPE structured array; malformed rows are dropped.
+    A prepared .npy file (see prepare_dataset) is memory-mapped read-only
+    instead of parsed.
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    if pd is None:
+        # read every column as float64 so bad or blank cells become NaN (and
+        # the row is dropped) instead of a string column or a -1 fill value
+        rows = np.genfromtxt(path, delimiter=",", names=True, usecols=list(FEATURE_DTYPES),
+                             dtype=np.float64, invalid_raise=False)
+        cols = [rows[c] for c in FEATURE_DTYPES]
+        ok = np.logical_and.reduce([np.isfinite(a) for a in cols])
+        return np.rec.fromarrays([a[ok] for a in cols], dtype=FEATURE_DTYPE)
+    df = pd.read_csv(path, usecols=list(FEATURE_DTYPES), engine="c", float_precision="round_trip")
+    for col in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    df.dropna(inplace=True)
+    return df[list(FEATURE_DTYPES)].astype(FEATURE_DTYPES).to_records(index=False)
+
+def prepare_dataset(csv_path=FEATURES_CSV, npy_path=FEATURES_NPY):
     """
-    rows = []
-    with open(path, "r", newline="") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            try:
-                rows.append({
-                    "timestamp": float(row["timestamp"]),
-                    "dpid": int(row["dpid"]),
-                    "port_no": int(row["port_no"]),
-                    "tx_bps": float(row["tx_bps"]),
-                    "rx_bps": float(row["rx_bps"]),
-                    "tx_pps": float(row["tx_pps"]),
-                    "rx_pps": float(row["rx_pps"]),
-                })
-            except Exception:
-                continue
+    One-time conversion of features.csv to a port-sorted FEATURE_DTYPE .npy
+    file, so later runs skip parsing and sorting. Returns the sorted rows.
+    """
+    rows, _, _ = group_by_port(load_features(csv_path))
+    np.save(npy_path, rows)
     return rows
 
-def group_by_port(rows):
-    groups = defaultdict(list)
-    for r in rows:
-        groups[(r["dpid"], r["port_no"])].append(r)
-    # sort each group by time
-    for k in groups:
-        groups[k].sort(key=lambda x: x["timestamp"])
-    return groups
-
-def norm_state(dpid, port_no, tx_bps, rx_bps):
-    tx_n = max(0.0, min(1.0, tx_bps / BPS_SCALE))
-    rx_n = max(0.0, min(1.0, rx_bps / BPS_SCALE))
-    dpid_n = min(1.0, dpid / 100.0)
-    port_n = min(1.0, port_no / 100.0)
-    return np.array([tx_n, rx_n, dpid_n, port_n], dtype=np.float32)
-
-def reward_from_state(state_vec):
+def group_by_port(rows, presorted=False):
+    """
+    Stable-sort rows by (dpid, port_no, timestamp) so every port is one
+    contiguous run (presorted=True skips the sort for prepared datasets).
+    Returns (sorted rows, starts, ends): the [start, end) row range of each port.
+    """
+    if not presorted:
+        rows = rows[np.lexsort((rows["timestamp"], rows["port_no"], rows["dpid"]))]
+    if len(rows) == 0:
+        return rows, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    dpid = np.asarray(rows["dpid"])
+    port = np.asarray(rows["port_no"])
+    cuts = np.flatnonzero((dpid[1:] != dpid[:-1]) | (port[1:] != port[:-1])) + 1
+    starts = np.concatenate(([0], cuts))
+    ends = np.concatenate((cuts, [len(rows)]))
+    return rows, starts, ends
+
+def norm_states(rows):
+    """(N, 4) float32 states [tx_n, rx_n, dpid_n, port_n] for every row."""
+    tx_n = np.clip(np.asarray(rows["tx_bps"]) / BPS_SCALE, 0.0, 1.0)
+    rx_n = np.clip(np.asarray(rows["rx_bps"]) / BPS_SCALE, 0.0, 1.0)
+    dpid_n = np.minimum(1.0, np.asarray(rows["dpid"]) / 100.0)
+    port_n = np.minimum(1.0, np.asarray(rows["port_no"]) / 100.0)
+    return np.stack([tx_n, rx_n, dpid_n, port_n], axis=1).astype(np.float32)
+
+def rewards_from_states(states):
     """
-    Simple shaping:
+    Simple shaping, per row:
       base = - rx_bps_norm
       penalty if rx_bps_norm > 0.8
     """
-    rx_n = float(state_vec[1])
-    rew = -rx_n
-    if rx_n > 0.8:
-        rew -= 0.5 * (rx_n - 0.8) / 0.2  # extra penalty up to -0.5
-    return rew
+    rx_n = states[:, 1].astype(np.float64)
+    # extra penalty up to -0.5; float32 like everything else the buffer holds
+    return (-rx_n - np.where(rx_n > 0.8, 0.5 * (rx_n - 0.8) / 0.2, 0.0)).astype(np.float32)
+
+if njit is not None:
+    # explicit signature: compiled once at import, not on the first call.
+    # Inputs are typed read-only ('A' layout), which accepts memory-mapped,
+    # parsed and strided columns alike; a second writable signature would
+    # make contiguous writable arrays ambiguous
+    _sig = types.void(*(types.Array(t, 1, 'A', readonly=True) for t in
+                        (types.float64, types.float64, types.int64, types.int64)),
+                      types.float32[:, :], types.float32[:])
+
+    @njit(_sig, parallel=True, fastmath=True, cache=True)
+    def _build_states_kernel(tx, rx, dpid, port, out_s, out_r):
+        # fused norm_states + rewards_from_states, one row per iteration
+        for i in prange(len(tx)):
+            out_s[i, 0] = min(max(tx[i] / BPS_SCALE, 0.0), 1.0)
+            out_s[i, 1] = min(max(rx[i] / BPS_SCALE, 0.0), 1.0)
+            out_s[i, 2] = min(1.0, dpid[i] / 100.0)
+            out_s[i, 3] = min(1.0, port[i] / 100.0)
+            rx_n = np.float64(out_s[i, 1])
+            rew = -rx_n
+            if rx_n > 0.8:
+                rew -= 0.5 * (rx_n - 0.8) / 0.2
+            out_r[i] = rew
+
+def build_states(rows):
+    """(states, rewards) for every row; numba kernel when available."""
+    if njit is None:
+        states = norm_states(rows)
+        return states, rewards_from_states(states)
+    states = np.empty((len(rows), 4), dtype=np.float32)
+    rewards = np.empty(len(rows), dtype=np.float32)
+    _build_states_kernel(*(np.asarray(rows[c]) for c in ("tx_bps", "rx_bps", "dpid", "port_no")),
+                         states, rewards)
+    return states, rewards
 
-def make_transitions(groups):
+def make_transitions(ends, states, rewards):
     """
-    Build (s, a, r, s2, done) tuples.
+    Build transitions as arrays (S, R, S2, D) from port-sorted rows; row i
+    and i+1 form a transition unless i is the last row of its port.
     We don't have ground-truth actions offline; treat action as 0 (noop) for buffer population,
     since DQN update uses max_a' Q(s2,a') for target and learns from rewards.
     """
-    transitions = []
-    for (dpid, port), seq in groups.items():
-        if len(seq) < 2:
-            continue
-        for i in range(len(seq) - 1):
-            cur = seq[i]
-            nxt = seq[i + 1]
-            s  = norm_state(dpid, port, cur["tx_bps"], cur["rx_bps"])
-            s2 = norm_state(dpid, port, nxt["tx_bps"], nxt["rx_bps"])
-            r  = reward_from_state(s2)  # reward based on *next* state
-            a  = 0  # placeholder (noop)
-            done = 0.0 if (i + 1) < (len(seq) - 1) else 1.0
-            transitions.append((s, a, r, s2, done))
-    return transitions
-
-def train_offline(transitions, epochs=5, steps_per_epoch=5000, seed=42):
-    random.seed(seed)
-    np.random.seed(seed)
-    torch.manual_seed(seed)
+    is_last = np.zeros(len(states), dtype=bool)
+    is_last[ends - 1] = True
+    valid = ~is_last[:-1]
+    S  = states[:-1][valid]
+    S2 = states[1:][valid]
+    R  = rewards[1:][valid]  # reward based on *next* state
+    D  = is_last[1:][valid].astype(np.uint8)  # next state ends the port's sequence
+    return S, R, S2, D
 
-    os.makedirs(MODEL_DIR, exist_ok=True)
-    cfg = DQNConfig(
+def offline_config(seed, device="auto", cuda_graph=CUDA_GRAPH):
+    cuda = torch.cuda.is_available() and device != "cpu"
+    return DQNConfig(
         state_dim=4,
         n_actions=4,
         hidden=64,
@@ -125,45 +205,158 @@ def train_offline(transitions, epochs=5, steps_per_epoch=5000, seed=42):
         start_epsilon=0.2,  # lower explore for offline
         end_epsilon=0.05,
         epsilon_decay=20000,
-        target_update_every=1000
+        target_update_every=1000,
+        # compiled (CUDA-graph) train steps only pay off on GPU; on CPU the
+        # compiled step is no faster than eager and adds seconds of warm-up
+        compile=cuda and COMPILE_ON_CUDA,
+        amp=cuda and AMP_ON_CUDA,
+        # the whole fixed-shape train step replayed as one CUDA graph
+        cuda_graph=cuda and cuda_graph,
+        device=device,
+        # contiguous sampling windows only pay off once the buffer outgrows
+        # the CPU caches (~40% faster gathers at 5M rows, none at 50k)
+        sample_block=0,
+        seed=seed
     )
+
+def train_offline(S, R, S2, D, epochs=5, steps_per_epoch=5000, seed=42, num_workers=1):
+    """
+    Fill a replay buffer with the offline transitions and train on it.
+    With num_workers > 1, that many learner processes share the buffer
+    read-only, each samples its own batches, and gradients are averaged
+    across them every step; steps_per_epoch is split between the learners.
+    """
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    cfg = offline_config(seed)
+
+    # Pre-fill buffer with offline transitions, shuffled: the port-sorted
+    # order would make an overflowing buffer keep only the last ports, and
+    # sample_block windows of neighbouring rows would be correlated
+    perm = np.random.default_rng(seed).permutation(len(S))
+    buf = ReplayBuffer(cfg.buffer_size, cfg.state_dim)
+    A = np.zeros(len(S), dtype=np.int64)  # action 0 (noop) placeholder
+    buf.add_batch(S[perm], A, R[perm], S2[perm], D[perm])
+    fields = tuple(f[:len(buf)] for f in buf.fields())
+
+    if num_workers <= 1:
+        _learner(0, 1, fields, epochs, steps_per_epoch, seed, MODEL_PATH)
+        return
+    # shared-memory tensors reach the spawned learners by handle, not by copy
+    fields = tuple(torch.from_numpy(f).share_memory_() for f in fields)
+    os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+    if "MASTER_PORT" not in os.environ:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            os.environ["MASTER_PORT"] = str(sock.getsockname()[1])
+    mp.spawn(_learner, args=(num_workers, fields, epochs, steps_per_epoch, seed, MODEL_PATH),
+             nprocs=num_workers)
+
+def _all_reduce_grads(params, world):
+    # one flat all-reduce instead of one per parameter tensor
+    grads = [p.grad for p in params]
+    flat = torch.cat([g.reshape(-1) for g in grads])
+    dist.all_reduce(flat)
+    flat /= world
+    for g, v in zip(grads, flat.split([g.numel() for g in grads])):
+        g.copy_(v.view_as(g))
+
+def _learner(rank, world, fields, epochs, steps_per_epoch, seed, model_path):
+    # batches are drawn from the agent's seeded Generator (cfg.seed); torch's
+    # seed only fixes the initial weights, which must match on every learner
+    torch.manual_seed(seed)
+
+    distributed = world > 1
+    device = "auto"
+    if distributed:
+        # one GPU per learner when there are enough, otherwise CPU learners
+        if torch.cuda.device_count() >= world:
+            device = f"cuda:{rank}"
+            torch.cuda.set_device(rank)
+            backend = "nccl"
+        else:
+            device = "cpu"
+            torch.set_num_threads(max(1, torch.get_num_threads() // world))
+            backend = "gloo"
+        dist.init_process_group(backend, rank=rank, world_size=world)
+
+    # learners differ only in the seed of the RNG they sample batches with;
+    # the all-reduce sits between backward and the optimizer step, outside any CUDA graph
+    cfg = offline_config(seed + rank, device=device, cuda_graph=CUDA_GRAPH and not distributed)
     agent = DQNAgent(cfg)
+    agent.buffer = ReplayBuffer.from_arrays(
+        *(f.numpy() if torch.is_tensor(f) else f for f in fields), rng=agent.rng,
+        block=cfg.sample_block)
+    if distributed:
+        params = list(agent.q.parameters())
+        agent.grad_hook = lambda: _all_reduce_grads(params, world)
+    if cfg.compile:
+        # trigger compilation for the fixed (batch_size, state_dim) shape before the loop
+        dummy = torch.zeros(cfg.batch_size, cfg.state_dim, device=agent.device)
+        agent.q_fwd(dummy)
+        with torch.no_grad():
+            agent.target_fwd(dummy)
+    if cfg.cuda_graph:
+        agent.capture_train_graph()
 
-    # Pre-fill buffer with offline transitions
-    for (s, a, r, s2, done) in transitions:
-        agent.remember(s, a, r, s2, done)
+    # The buffer is frozen from here on and every action is the noop, so the
+    # Bellman targets only change when the target network is synced: move
+    # the whole buffer to the device once, recompute all targets once per
+    # sync (every target_update_every steps and at each epoch start), and
+    # every step is then an on-device index draw, a gather and a single
+    # online forward/backward, with no host<->device traffic
+    agent.buffer.to_device(agent.device)
+    n = len(agent.buffer)
+    S_dev = agent.buffer.states
+    A_dev = agent.buffer.actions.unsqueeze(1)
 
     # Offline training loop
+    bs = cfg.batch_size
+    steps = -(-steps_per_epoch // world) if n >= bs else 0
     for ep in range(1, epochs + 1):
-        losses = []
-        for step in range(steps_per_epoch):
-            loss = agent.train_step()
-            if loss:
-                losses.append(loss)
-        avg_loss = (sum(losses) / len(losses)) if losses else 0.0
-        print(f"[epoch {ep}/{epochs}] avg_loss={avg_loss:.6f} buffer={len(agent.buffer)}")
-        # refresh target
-        agent.target.load_state_dict(agent.q.state_dict())
-
-    # Save model
-    agent.save(MODEL_PATH)
-    print(f"[+] Saved model to {MODEL_PATH}")
+        loss_sum = torch.zeros((), device=agent.device)  # summed on device: one sync per epoch
+        for step in range(steps):
+            if step % cfg.target_update_every == 0:
+                agent.target.load_state_dict(agent.q.state_dict())
+                Y_dev = agent.buffer_targets()
+            k = step % MACRO_BATCH_STEPS
+            if k == 0:
+                # draw the next MACRO_BATCH_STEPS batches' indices at once
+                m = min(MACRO_BATCH_STEPS, steps - step)
+                idx = agent.buffer.sample_indices(m * bs)
+            i = idx[k * bs:(k + 1) * bs]
+            loss_sum += agent.fit(S_dev[i], A_dev[i], Y_dev[i])
+        avg_loss = (loss_sum / steps).item() if steps else 0.0
+        if rank == 0:
+            print(f"[epoch {ep}/{epochs}] avg_loss={avg_loss:.6f} buffer={n}")
+
+    # Save model (weights are identical on every learner)
+    if rank == 0:
+        agent.save(model_path)
+        print(f"[+] Saved model to {model_path}")
+    if distributed:
+        dist.destroy_process_group()
 
 def main():
     if not os.path.exists(FEATURES_CSV):
         print(f"[!] features file missing: {FEATURES_CSV}")
         return
-    rows = load_features(FEATURES_CSV)
-    if not rows:
+    # reuse the prepared dataset unless features.csv has been rewritten since
+    if (not os.path.exists(FEATURES_NPY)
+            or os.path.getmtime(FEATURES_NPY) < os.path.getmtime(FEATURES_CSV)):
+        prepare_dataset(FEATURES_CSV, FEATURES_NPY)
+        print(f"[i] prepared {FEATURES_NPY}")
+    rows = load_features(FEATURES_NPY)
+    if len(rows) == 0:
         print(f"[!] no rows in {FEATURES_CSV}")
         return
-    groups = group_by_port(rows)
-    transitions = make_transitions(groups)
-    if not transitions:
+    rows, starts, ends = group_by_port(rows, presorted=True)
+    states, rewards = build_states(rows)
+    S, R, S2, D = make_transitions(ends, states, rewards)
+    if len(S) == 0:
         print("[!] no transitions built (need >=2 samples per (dpid,port))")
         return
-    print(f"[i] transitions: {len(transitions)} across {len(groups)} ports")
-    train_offline(transitions, epochs=5, steps_per_epoch=5000, seed=42)
+    print(f"[i] transitions: {len(S)} across {len(starts)} ports")
+    train_offline(S, R, S2, D, epochs=5, steps_per_epoch=5000, seed=42, num_workers=NUM_WORKERS)
 
 if __name__ == "__main__":
     main()